@@ -1,12 +1,26 @@
+import asyncio
+import atexit
+import hashlib
+import json
 import os
+import queue
 import sys
 import logging
-import re
-from pathlib import Path
+import mmap
+import random
 import time
-from openai import OpenAI
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import httpx
+from openai import AsyncOpenAI, RateLimitError
 import shutil
 
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 # ==============================
 #           CONFIGURATION
 # ==============================
@@ -14,16 +28,52 @@ import shutil
 ROOT_DIRECTORY = '.'
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 GPT_MODEL = 'gpt-4o-mini'
+TIKTOKEN_ENCODING = 'o200k_base' # Encoding used by the gpt-4o model family
 GPT_MAX_TOKENS = 3000
 GPT_TEMPERATURE = 0.2
+SHARD_MAX_CHARS = 60000 # Shard budget when tiktoken is not installed
+SHARD_MAX_TOKENS = 15000 # Shard budget when tiktoken is available
+SHARD_MAX_FILES = 0 # Cap on files per shard; 0 = no cap, 1 = one request per file
+USE_BATCH_API = False # Use the OpenAI Batch API (50% cheaper, up to 24h turnaround)
+BATCH_POLL_INTERVAL = 30 # Seconds between Batch API status checks
+BACKOFF_BASE_SECONDS = 1.0 # Lower bound for the jittered retry delay
+BACKOFF_CAP_SECONDS = 30.0 # Upper bound for the jittered retry delay
+MAX_CONCURRENT_REQUESTS = 10 # Cap on simultaneous GPT requests
+MAX_REQUESTS_PER_MINUTE = 500 # Stay under the account's RPM quota
+MAX_TOKENS_PER_MINUTE = 200000 # Stay under the account's TPM quota
 COST_PER_INPUT_TOKEN = 2.50 / 1000000 # $2.50 per 1M input tokens
 COST_PER_OUTPUT_TOKEN = 10.00 / 1000000 # $10.00 per 1M output tokens
 USE_BLACKLIST = True
 EXCLUDE_DIRS = ['.git', 'node_modules']
 EXCLUDE_FILES = ['package-lock.json', 'autocode.py']
-EXCLUDE_EXTENSIONS = ['.log', '.png']
+EXCLUDE_EXTENSIONS = [
+    '.log',
+    # Common binary formats: images, media, fonts, archives and
+    # compiled artifacts. Anything that slips through is still caught
+    # by the NUL-byte sniff in read_file_content.
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.mp3', '.mp4', '.wav',
+    '.woff', '.woff2', '.ttf',
+    '.pdf', '.zip', '.tar', '.gz',
+    '.pyc', '.so', '.dll', '.exe', '.class', '.jar',
+]
 INCLUDE_DIRS = []
 INCLUDE_FILES = []
+USE_FILE_CACHE = True # Keep per-file metadata across runs, keyed by mtime/size
+CACHE_DIR = os.path.expanduser('~/.cache/autocode')
+VERBOSE_LOG_ENABLED = False # Write full prompts/responses to gpt.log (can dominate wall time)
+USE_RESPONSE_CACHE = True # Reuse parsed GPT responses for identical prompts
+
+# Lookup structures derived from the configuration above, built once at import:
+# frozensets give O(1) membership tests and the lowercased extension tuple lets
+# str.endswith check every extension in a single C-level call. Paths are
+# normalized here so the walker never re-normalizes them per call; since these
+# are already frozensets, get_all_files passes them through without copying.
+EXCLUDE_DIRS_SET = frozenset(os.path.normpath(p.rstrip('/')) for p in EXCLUDE_DIRS)
+EXCLUDE_FILES_SET = frozenset(os.path.normpath(p) for p in EXCLUDE_FILES)
+INCLUDE_DIRS_SET = frozenset(os.path.normpath(p.rstrip('/')) for p in INCLUDE_DIRS)
+INCLUDE_FILES_SET = frozenset(os.path.normpath(p) for p in INCLUDE_FILES)
+EXCLUDE_EXT_TUPLE = tuple(ext.lower() for ext in EXCLUDE_EXTENSIONS)
 
 # System message for GPT
 GPT_SYSTEM_MESSAGE = """You are an artificial intelligence agent that codes.
@@ -34,88 +84,200 @@ GPT_SYSTEM_MESSAGE = """You are an artificial intelligence agent that codes.
 # ==============================
 
 def setup_logging():
-    logging.basicConfig(
-        filename='gpt.log',
-        level=logging.DEBUG,
-        format='%(asctime)s [%(levelname)s] %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S',
-    )
+    # Full prompts and responses only reach the log file when verbose
+    # logging is on; for large repos that debug output can dwarf the
+    # actual work.
+    #
+    # Log records go through a queue drained by a background listener,
+    # so worker threads and coroutines never block on (or serialize
+    # around) the file and console handlers.
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    file_handler = logging.FileHandler('gpt.log')
+    file_handler.setLevel(logging.DEBUG if VERBOSE_LOG_ENABLED else logging.INFO)
+    file_handler.setFormatter(formatter)
+
     console = logging.StreamHandler()
     console.setLevel(logging.INFO)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
     console.setFormatter(formatter)
-    logging.getLogger('').addHandler(console)
+
+    log_queue = queue.Queue(-1)
+    root_logger = logging.getLogger('')
+    root_logger.setLevel(logging.DEBUG if VERBOSE_LOG_ENABLED else logging.INFO)
+    root_logger.addHandler(QueueHandler(log_queue))
+
+    listener = QueueListener(log_queue, file_handler, console, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
 
 # ==============================
 #          FILE HANDLING
 # ==============================
 
+# Only mmap files at least this large; below that the mapping setup
+# costs more than the copy it saves.
+MMAP_MIN_SIZE = 256 * 1024
+# How much of a file to sniff for NUL bytes before treating it as text.
+BINARY_SNIFF_BYTES = 8192
+
 def read_file_content(file_path):
     """
-    Read the content of a file. Returns None if there's an error.
+    Read the content of a file. Returns None if there's an error or the
+    file looks binary.
+
+    A NUL byte in the first 8 KB marks the file as binary (git's
+    heuristic), skipping it before any UTF-8 decoding work. Large text
+    files are mapped with mmap and decoded straight from the kernel's
+    page cache, skipping the intermediate userspace copy a plain read()
+    would make.
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return content
+        if os.path.getsize(file_path) >= MMAP_MIN_SIZE:
+            with open(file_path, 'rb') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    if b'\x00' in mapped[:BINARY_SNIFF_BYTES]:
+                        logging.warning("Skipping binary file %s", file_path)
+                        return None
+                    if hasattr(mapped, 'madvise'):
+                        mapped.madvise(mmap.MADV_SEQUENTIAL)
+                    return str(memoryview(mapped), 'utf-8')
+        with open(file_path, 'rb') as f:
+            head = f.read(BINARY_SNIFF_BYTES)
+            if b'\x00' in head:
+                logging.warning("Skipping binary file %s", file_path)
+                return None
+            return (head + f.read()).decode('utf-8')
     except Exception as e:
-        logging.error(f"Error reading {file_path}: {str(e)}")
+        logging.error("Error reading %s: %s", file_path, e)
         return None
 
 def write_file_content(file_path, content):
     """
     Write content to a file. Creates the file if it doesn't exist.
+
+    The content goes to a sibling temp file first and is moved into
+    place with os.replace, which is atomic on POSIX and Windows, so an
+    interrupted run never leaves a half-written file behind. An
+    existing target's permission bits carry over to the replacement.
     """
+    tmp_path = file_path + '.autocode.tmp'
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             f.write(content)
-        logging.info(f"Successfully wrote to {file_path}")
+        if os.path.exists(file_path):
+            shutil.copymode(file_path, tmp_path)
+        os.replace(tmp_path, file_path)
+        logging.info("Successfully wrote to %s", file_path)
     except Exception as e:
-        logging.error(f"Error writing to {file_path}: {str(e)}")
+        logging.error("Error writing to %s: %s", file_path, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
 
 # ==============================
 #        FILE FILTERING
 # ==============================
 
+# Walk top-level subdirectories on a thread pool only when there are
+# more than this many; below that the thread overhead outweighs the
+# overlapped directory reads.
+PARALLEL_WALK_MIN_SUBDIRS = 4
+
 def get_all_files(ROOT_DIRECTORY, exclude_dirs=None, exclude_files=None, include_dirs=None, include_files=None, use_blacklist=True):
     """
     Recursively get all file paths under ROOT_DIRECTORY.
     Apply exclusion or inclusion based on the mode.
+
+    Uses os.scandir so each entry's type comes from the DirEntry cache
+    instead of a separate stat call per path.
     """
+    exclude_dirs = frozenset(exclude_dirs or ())
+    exclude_files = frozenset(exclude_files or ())
+    include_dirs = frozenset(include_dirs or ())
+    include_files = frozenset(include_files or ())
+
+    # Bare names (e.g. 'node_modules') are pruned wherever they appear;
+    # entries containing a separator only match at their configured path.
+    exclude_dir_names = frozenset(d for d in exclude_dirs if os.sep not in d)
+
+    def _wanted_dir(rel_path, name):
+        if use_blacklist:
+            return name not in exclude_dir_names and rel_path not in exclude_dirs
+        if not include_dirs:
+            return True
+        # Descend only if this directory is an included dir, lies inside
+        # one, or is an ancestor of one; unrelated subtrees are skipped
+        # entirely instead of being walked and filtered file by file.
+        prefix = rel_path + os.sep
+        return any(
+            inc_dir == rel_path or inc_dir.startswith(prefix) or rel_path.startswith(inc_dir + os.sep)
+            for inc_dir in include_dirs
+        )
+
+    def _wanted_file(rel_path):
+        if use_blacklist:
+            # Blacklist Mode: Exclude specified files
+            if exclude_files and rel_path in exclude_files:
+                return False
+            # Further filter out files based on excluded extensions
+            if EXCLUDE_EXT_TUPLE and rel_path.lower().endswith(EXCLUDE_EXT_TUPLE):
+                return False
+        else:
+            # Whitelist Mode: Include only specified directories or files
+            if include_dirs and not any(rel_path.startswith(inc_dir + os.sep) for inc_dir in include_dirs):
+                return False
+            if include_files and rel_path not in include_files:
+                return False
+        return True
+
+    def _walk(dir_path, rel_dir):
+        collected = []
+        try:
+            entries = os.scandir(dir_path)
+        except OSError as e:
+            logging.error("Error scanning directory %s: %s", dir_path, e)
+            return collected
+        with entries:
+            for entry in entries:
+                rel_path = entry.name if not rel_dir else rel_dir + os.sep + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    # Prune excluded (blacklist) or unrelated (whitelist)
+                    # directories so we never descend into them.
+                    if _wanted_dir(rel_path, entry.name):
+                        collected.extend(_walk(entry.path, rel_path))
+                elif entry.is_file(follow_symlinks=False) and _wanted_file(rel_path):
+                    collected.append(rel_path)
+        return collected
+
+    # Scan the root level once, then walk each kept top-level directory.
+    # With enough subdirectories the walks run on a thread pool so their
+    # readdir waits overlap; small trees stay sequential to avoid the
+    # thread overhead.
     all_files = []
-    for dirpath, dirnames, filenames in os.walk(ROOT_DIRECTORY):
-        # Compute relative path from ROOT_DIRECTORY
-        rel_dir = os.path.relpath(dirpath, ROOT_DIRECTORY)
-        if rel_dir == '.':
-            rel_dir = ''
-
-        # Exclude directories if in blacklist mode
-        if use_blacklist and exclude_dirs:
-            dirnames[:] = [d for d in dirnames if os.path.join(rel_dir, d) not in exclude_dirs]
-
-        # Include only specified directories if in whitelist mode
-        if not use_blacklist and include_dirs:
-            dirnames[:] = [d for d in dirnames if os.path.join(rel_dir, d) in include_dirs]
-
-        for filename in filenames:
-            file_rel_path = os.path.normpath(os.path.join(rel_dir, filename))
-            if use_blacklist:
-                # Blacklist Mode: Exclude specified directories or files
-                if exclude_files and file_rel_path in exclude_files:
-                    continue
-                if exclude_dirs and any(file_rel_path.startswith(inc_dir + os.sep) for inc_dir in exclude_dirs):
-                    continue
-                # Further filter out files based on excluded extensions
-                if EXCLUDE_EXTENSIONS and any(file_rel_path.lower().endswith(ext.lower()) for ext in EXCLUDE_EXTENSIONS):
-                    continue
-            else:
-                # Whitelist Mode: Include only specified directories or files
-                if include_dirs and not any(file_rel_path.startswith(inc_dir + os.sep) for inc_dir in include_dirs):
-                    continue
-                if include_files and file_rel_path not in include_files:
-                    continue
+    top_dirs = []
+    try:
+        with os.scandir(ROOT_DIRECTORY) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if _wanted_dir(entry.name, entry.name):
+                        top_dirs.append((entry.path, entry.name))
+                elif entry.is_file(follow_symlinks=False) and _wanted_file(entry.name):
+                    all_files.append(entry.name)
+    except OSError as e:
+        logging.error(f"Error scanning directory {ROOT_DIRECTORY}: {str(e)}")
 
-            all_files.append(file_rel_path)
+    if len(top_dirs) > PARALLEL_WALK_MIN_SUBDIRS:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [executor.submit(_walk, path, rel) for path, rel in top_dirs]
+            # Collect in submission order, not completion order: the file
+            # order feeds shard packing and the prompt-hash response
+            # cache, so it must be stable across runs.
+            for future in futures:
+                all_files.extend(future.result())
+    else:
+        for path, rel in top_dirs:
+            all_files.extend(_walk(path, rel))
 
     logging.info(f"Total files to process: {len(all_files)}")
     return all_files
@@ -127,39 +289,82 @@ def get_files_to_process(ROOT_DIRECTORY, use_blacklist=True):
     if use_blacklist:
         files = get_all_files(
             ROOT_DIRECTORY,
-            exclude_dirs=EXCLUDE_DIRS,
-            exclude_files=EXCLUDE_FILES,
+            exclude_dirs=EXCLUDE_DIRS_SET,
+            exclude_files=EXCLUDE_FILES_SET,
             use_blacklist=True
         )
 
-        # Further filter out files based on excluded extensions
-        files = [
-            f for f in files
-            if not any(f.lower().endswith(ext.lower()) for ext in EXCLUDE_EXTENSIONS)
-        ]
-
         logging.info(f"Using blacklist mode with {len(files)} files after exclusions.")
     else:
         files = get_all_files(
             ROOT_DIRECTORY,
-            include_dirs=INCLUDE_DIRS,
-            include_files=INCLUDE_FILES,
+            include_dirs=INCLUDE_DIRS_SET,
+            include_files=INCLUDE_FILES_SET,
             use_blacklist=False
         )
 
         logging.info(f"Using whitelist mode with {len(files)} specified files.")
 
-    existing_files = []
-    for file_path in files:
-        absolute_path = os.path.join(ROOT_DIRECTORY, file_path)
-        if os.path.isfile(absolute_path):
-            existing_files.append(file_path)
-        else:
-            logging.warning(f"File {file_path} does not exist. Skipping.")
+    # No separate existence pass: scandir already confirmed each entry is a file.
+    return files
+
+# ==============================
+#      FILE METADATA CACHE
+# ==============================
+
+def get_cache_path(root_directory):
+    """
+    Per-repo cache file path, keyed by a hash of the absolute root.
+    """
+    repo_hash = hashlib.sha256(os.path.abspath(root_directory).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, repo_hash + '.json')
+
+def load_file_cache(root_directory):
+    """
+    Load the {path: {mtime, size, tokens}} cache from the previous run.
+    Returns an empty dict when missing or unreadable.
+    """
+    try:
+        with open(get_cache_path(root_directory), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    logging.info(f"Existing files to process: {len(existing_files)}")
+def save_file_cache(root_directory, cache):
+    """
+    Persist the metadata cache for the next invocation.
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(get_cache_path(root_directory), 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+    except OSError as e:
+        logging.warning(f"Could not save file cache: {str(e)}")
 
-    return existing_files
+def refresh_file_cache(cache, root_directory, files_to_process):
+    """
+    Validate each file's cache entry against its current mtime and size.
+    Unchanged files keep their entry, including derived metadata such as
+    the token count, so later stages can skip recomputing it; changed
+    files get a bare entry to be filled in again. Stale entries are
+    dropped.
+    """
+    unchanged = 0
+    fresh = {}
+    for file_path in files_to_process:
+        absolute_path = os.path.join(root_directory, file_path)
+        try:
+            stat = os.stat(absolute_path)
+        except OSError:
+            continue
+        entry = cache.get(file_path)
+        if entry is not None and entry.get('mtime') == stat.st_mtime and entry.get('size') == stat.st_size:
+            unchanged += 1
+        else:
+            entry = {'mtime': stat.st_mtime, 'size': stat.st_size}
+        fresh[file_path] = entry
+    logging.info(f"File cache: {unchanged} of {len(files_to_process)} files unchanged since last run.")
+    return fresh
 
 # ==============================
 #        USER PROMPT
@@ -188,47 +393,277 @@ def get_user_prompt():
 #      LANGUAGE DETECTION
 # ==============================
 
+_LANGUAGE_MAPPING = {
+    ".py": "python",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".tsx": "tsx",
+    ".scss": "scss",
+    ".css": "css",
+    ".html": "html",
+    ".jsx": "jsx",
+    ".json": "json",
+    ".md": "markdown",
+    # Add more mappings as needed
+}
+
 def get_language(file_path):
     """
     Determine the programming language based on the file extension.
     """
-    language_mapping = {
-        ".py": "python",
-        ".js": "javascript",
-        ".ts": "typescript",
-        ".tsx": "tsx",
-        ".scss": "scss",
-        ".css": "css",
-        ".html": "html",
-        ".jsx": "jsx",
-        ".json": "json",
-        ".md": "markdown",
-        # Add more mappings as needed
-    }
-    ext = Path(file_path).suffix.lower()
-    return language_mapping.get(ext, "")
+    return _LANGUAGE_MAPPING.get(os.path.splitext(file_path)[1].lower(), "")
+
+# ==============================
+#        FILE SHARDING
+# ==============================
+
+_encoding = None
+
+def get_encoding():
+    """
+    Cached tiktoken encoding, or None when tiktoken is not installed.
+    The encoding is named directly rather than looked up from the model
+    string, and loading the merges table costs tens of ms, so it only
+    happens once.
+    """
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+    return _encoding
+
+def count_tokens(files_content, file_cache=None):
+    """
+    Token count per file, or None when tiktoken is not installed.
+    Counts stored in the file cache are reused for files unchanged
+    since the last run; only changed files are encoded, on a thread
+    pool since tiktoken releases the GIL. New counts are written back
+    to the cache entries for the next run.
+    """
+    encoding = get_encoding()
+    if encoding is None:
+        return None
+
+    counts = {}
+    to_encode = []
+    for file_path in files_content:
+        entry = file_cache.get(file_path) if file_cache is not None else None
+        if entry is not None and 'tokens' in entry:
+            counts[file_path] = entry['tokens']
+        else:
+            to_encode.append(file_path)
+
+    if to_encode:
+        max_workers = min(32, (os.cpu_count() or 1))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            encoded = executor.map(lambda p: len(encoding.encode(files_content[p])), to_encode)
+        for file_path, tokens in zip(to_encode, encoded):
+            counts[file_path] = tokens
+            if file_cache is not None and file_path in file_cache:
+                file_cache[file_path]['tokens'] = tokens
+
+    logging.info(f"Token counts: {len(counts) - len(to_encode)} cached, {len(to_encode)} encoded.")
+    return counts
+
+def shard_files(files_content, token_counts=None):
+    """
+    Greedily split files_content into shards so each can be sent as its
+    own GPT request. Shards are packed against a token budget when
+    token_counts is given (real counts from tiktoken) and a character
+    budget otherwise. A file larger than the budget gets a shard of its
+    own. SHARD_MAX_FILES additionally caps how many files share a
+    shard; setting it to 1 gives one request per file, trading prompt
+    duplication for maximum request-level parallelism.
+    """
+    if token_counts is not None:
+        budget = SHARD_MAX_TOKENS
+        size_of = token_counts.__getitem__
+    else:
+        budget = SHARD_MAX_CHARS
+        size_of = lambda file_path: len(files_content[file_path])
+
+    shards = []
+    current = {}
+    current_size = 0
+    for file_path, content in files_content.items():
+        size = size_of(file_path)
+        if current and (current_size + size > budget or (SHARD_MAX_FILES and len(current) >= SHARD_MAX_FILES)):
+            shards.append(current)
+            current = {}
+            current_size = 0
+        current[file_path] = content
+        current_size += size
+    if current:
+        shards.append(current)
+    return shards
 
 # ==============================
 #        GPT API CALL
 # ==============================
 
-def call_gpt_api(prompt, files_content, model=GPT_MODEL, max_retries=5):
+class RateLimiter:
     """
-    Call the OpenAI GPT API with the given prompt and files content.
-    Returns the response text and token usage.
+    Token-bucket throttler for OpenAI's per-minute request and token
+    quotas. Requests wait for capacity up front, so concurrent shards
+    pace themselves against the configured limits instead of slamming
+    into 429s and recovering with blind backoff.
     """
-    if not OPENAI_API_KEY:
-        logging.error("OPENAI_API_KEY environment variable not set.")
-        sys.exit(1)
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.last_refill = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_refill
+        self.last_refill = now
+        self.available_requests = min(
+            float(self.requests_per_minute),
+            self.available_requests + self.requests_per_minute * elapsed / 60.0,
+        )
+        self.available_tokens = min(
+            float(self.tokens_per_minute),
+            self.available_tokens + self.tokens_per_minute * elapsed / 60.0,
+        )
+
+    async def acquire(self, tokens):
+        if tokens > self.tokens_per_minute:
+            # The bucket never holds more than one minute's quota, so a
+            # bigger request could wait forever. Clamp it: the request
+            # still drains the full bucket, it just goes out once the
+            # bucket is full instead of hanging.
+            logging.warning(
+                "Request estimated at %d tokens exceeds MAX_TOKENS_PER_MINUTE (%d); "
+                "sending it anyway once a full minute's quota is available.",
+                tokens, self.tokens_per_minute,
+            )
+            tokens = self.tokens_per_minute
+        while True:
+            self._refill()
+            if self.available_requests >= 1 and self.available_tokens >= tokens:
+                self.available_requests -= 1
+                self.available_tokens -= tokens
+                return
+            await asyncio.sleep(0.05)
+
+    def penalize(self):
+        # Called on a 429: halve both buckets so the other in-flight
+        # shards slow down too instead of each discovering the limit.
+        self.available_requests /= 2
+        self.available_tokens /= 2
+
+_rate_limiter = None
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE, MAX_TOKENS_PER_MINUTE)
+    return _rate_limiter
+
+def estimate_request_tokens(user_message):
+    """
+    Estimated total tokens for one request: prompt tokens (exact via
+    tiktoken when installed, roughly 4 chars per token otherwise) plus
+    the completion budget.
+    """
+    encoding = get_encoding()
+    if encoding is not None:
+        prompt_tokens = len(encoding.encode(user_message)) + len(encoding.encode(GPT_SYSTEM_MESSAGE))
+    else:
+        prompt_tokens = (len(user_message) + len(GPT_SYSTEM_MESSAGE)) // 4
+    return prompt_tokens + GPT_MAX_TOKENS
+
+RESPONSE_CACHE_DIR = os.path.join(CACHE_DIR, 'responses')
+
+def get_response_cache_path(user_message, model):
+    """
+    Cache file path for one request, keyed by an exact-match hash of
+    the model, system message and user message.
+    """
+    key = hashlib.sha256((model + GPT_SYSTEM_MESSAGE + user_message).encode('utf-8')).hexdigest()
+    return os.path.join(RESPONSE_CACHE_DIR, key + '.json')
+
+def load_cached_response(user_message, model):
+    """
+    Return cached (modified_files, files_to_delete) for an identical
+    earlier request, or None on a miss.
+    """
+    try:
+        with open(get_response_cache_path(user_message, model), 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        return cached['modified_files'], cached['files_to_delete']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_cached_response(user_message, model, modified_files, files_to_delete):
+    """
+    Persist a parsed response atomically (temp file + os.replace) so a
+    crash mid-write cannot leave a corrupt cache entry.
+    """
+    try:
+        os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+        cache_path = get_response_cache_path(user_message, model)
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'modified_files': modified_files, 'files_to_delete': files_to_delete}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logging.warning(f"Could not save response cache entry: {str(e)}")
+
+_client = None
+
+def get_client():
+    """
+    Shared AsyncOpenAI client, created on first use. Reusing one client
+    keeps a single connection pool alive so concurrent shards and
+    retries skip the TLS handshake instead of paying it per call.
+    """
+    global _client
+    if _client is None:
+        if not OPENAI_API_KEY:
+            logging.error("OPENAI_API_KEY environment variable not set.")
+            sys.exit(1)
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            max_retries=0,  # The call sites handle retries themselves
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=20)
+            ),
+        )
+    return _client
+
+def _retry_after_seconds(error):
+    """
+    Seconds requested by the Retry-After header on a rate-limit error's
+    response, or None when absent or unparseable.
+    """
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
 
-    context = ""
+def build_user_message(prompt, files_content):
+    """
+    Build the user message combining the prompt, the files content and
+    the response format instructions.
+    """
+    # Collect the parts and join once; += on a growing string would
+    # recopy everything accumulated so far on each iteration.
+    parts = []
     for file_path, content in files_content.items():
         language = get_language(file_path)
-        context += f"### File: {file_path}\n```{language}\n{content}\n```\n\n"
+        parts.append(f"### File: {file_path}\n```{language}\n{content}\n```\n\n")
+    context = ''.join(parts)
 
-    user_message = (
+    return (
         f"{prompt}\n\n"
         "Here is the existing codebase:\n\n"
         f"{context}\n\n"
@@ -245,13 +680,48 @@ def call_gpt_api(prompt, files_content, model=GPT_MODEL, max_retries=5):
         "Do not add code comments that describe changes. For example, writing '// Changed the function name' is not allowed."
     )
 
-    logging.debug("Preparing to send the following user message to OpenAI API:")
-    logging.debug(user_message)
+async def call_gpt_api(prompt, files_content, model=GPT_MODEL, max_retries=5, on_file=None):
+    """
+    Call the OpenAI GPT API with the given prompt and files content.
+    Returns (modified_files, files_to_delete, usage).
+
+    The completion is streamed and parsed incrementally, so each file
+    block is available (via the optional on_file callback) as soon as
+    its closing fence arrives instead of after the full response.
+
+    Async so multiple requests can be in flight at once; the event loop
+    hides the network latency instead of blocking on each round-trip.
+    """
+    client = get_client()
+
+    user_message = build_user_message(prompt, files_content)
 
+    debug_enabled = logging.getLogger().isEnabledFor(logging.DEBUG)
+    if debug_enabled:
+        logging.debug("Preparing to send the following user message to OpenAI API:")
+        logging.debug(user_message)
+
+    if USE_RESPONSE_CACHE:
+        cached = load_cached_response(user_message, model)
+        if cached is not None:
+            # Identical prompt seen before: reuse its parsed response and
+            # skip the network entirely. No usage is reported since no
+            # tokens were spent.
+            logging.info("Response cache hit; skipping OpenAI API call.")
+            modified_files, files_to_delete = cached
+            if on_file is not None:
+                for file_path, code in modified_files.items():
+                    on_file(file_path, code)
+            return modified_files, files_to_delete, None
+
+    estimated_tokens = estimate_request_tokens(user_message)
+
+    wait_time = BACKOFF_BASE_SECONDS
     for attempt in range(1, max_retries + 1):
         try:
+            await get_rate_limiter().acquire(estimated_tokens)
             logging.info(f"Attempting to call OpenAI API (Attempt {attempt}/{max_retries})")
-            response = client.chat.completions.create(
+            stream = await client.chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": GPT_SYSTEM_MESSAGE},
@@ -259,56 +729,198 @@ def call_gpt_api(prompt, files_content, model=GPT_MODEL, max_retries=5):
                 ],
                 temperature=GPT_TEMPERATURE,
                 max_tokens=GPT_MAX_TOKENS,
+                stream=True,
+                stream_options={"include_usage": True},
             )
+            parser = StreamingResponseParser(on_file=on_file)
+            usage = None
+            finish_reason = None
+            response_chunks = []
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if chunk.choices:
+                    if chunk.choices[0].finish_reason is not None:
+                        finish_reason = chunk.choices[0].finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if debug_enabled:
+                            response_chunks.append(delta)
+                        parser.feed(delta)
+            parser.close()
             logging.info("Successfully received response from OpenAI API.")
-            logging.debug("OpenAI API response:")
-            logging.debug(response.choices[0].message.content)
-            return response.choices[0].message.content, response.usage
+            if debug_enabled:
+                logging.debug("OpenAI API response:")
+                logging.debug(''.join(response_chunks))
+            files_to_delete = list(parser.files_to_delete)
+            truncated = finish_reason == "length" or parser.incomplete
+            if truncated:
+                # A response cut off by max_tokens parses to a partial
+                # result; caching it would replay the bad parse forever
+                # instead of letting a rerun get a fresh attempt.
+                logging.warning(f"Response was truncated (finish_reason={finish_reason}); not caching it.")
+            elif USE_RESPONSE_CACHE:
+                save_cached_response(user_message, model, parser.modified_files, files_to_delete)
+            return parser.modified_files, files_to_delete, usage
+        except RateLimitError as e:
+            get_rate_limiter().penalize()
+            # Decorrelated jitter keeps concurrent shards from retrying
+            # in lockstep; an explicit Retry-After from the server wins.
+            wait_time = min(BACKOFF_CAP_SECONDS, random.uniform(BACKOFF_BASE_SECONDS, wait_time * 3))
+            retry_after = _retry_after_seconds(e)
+            if retry_after is not None:
+                wait_time = retry_after + random.uniform(0, 1)
+            logging.error(f"Rate limited during API call: {e}. Retrying after delay...")
         except Exception as e:
+            wait_time = min(BACKOFF_CAP_SECONDS, random.uniform(BACKOFF_BASE_SECONDS, wait_time * 3))
             logging.error(f"Error during API call: {e}. Retrying after delay...")
             logging.debug(f"Exception details: {e}")
 
-        wait_time = 2 ** attempt
-        logging.info(f"Waiting for {wait_time} seconds before retrying...")
-        time.sleep(wait_time)
+        logging.info(f"Waiting for {wait_time:.1f} seconds before retrying...")
+        await asyncio.sleep(wait_time)
 
     logging.critical("Failed to get a response from OpenAI API after multiple attempts.")
     sys.exit(1)
 
+async def call_gpt_batch_api(prompt, shards, model=GPT_MODEL):
+    """
+    Submit all shards in a single job through the OpenAI Batch API and
+    poll until it finishes. Returns a list of (modified_files,
+    files_to_delete, usage) tuples in shard order. Batch requests cost
+    half as much as the synchronous API but may take up to 24 hours to
+    complete.
+    """
+    client = get_client()
+
+    lines = []
+    for index, shard in enumerate(shards):
+        request = {
+            "custom_id": f"shard-{index}",
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": GPT_SYSTEM_MESSAGE},
+                    {"role": "user", "content": build_user_message(prompt, shard)}
+                ],
+                "temperature": GPT_TEMPERATURE,
+                "max_tokens": GPT_MAX_TOKENS,
+            },
+        }
+        lines.append(json.dumps(request))
+    jsonl_payload = "\n".join(lines).encode('utf-8')
+
+    input_file = await client.files.create(file=("autocode_batch.jsonl", jsonl_payload), purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logging.info(f"Submitted batch {batch.id} with {len(shards)} request(s). Polling for completion...")
+
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(BATCH_POLL_INTERVAL)
+        batch = await client.batches.retrieve(batch.id)
+        logging.info(f"Batch {batch.id} status: {batch.status}")
+
+    if batch.status != "completed":
+        logging.critical(f"Batch {batch.id} ended with status {batch.status}.")
+        sys.exit(1)
+
+    output = await client.files.content(batch.output_file_id)
+    responses = {}
+    for line in output.text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        body = result["response"]["body"]
+        usage = body.get("usage")
+        if usage is not None:
+            usage = SimpleNamespace(**usage)
+        modified_files, files_to_delete = parse_gpt_response(body["choices"][0]["message"]["content"])
+        responses[result["custom_id"]] = (modified_files, files_to_delete, usage)
+
+    return [responses[f"shard-{index}"] for index in range(len(shards))]
+
 # ==============================
 #        GPT RESPONSE PARSING
 # ==============================
 
+class StreamingResponseParser:
+    """
+    Incremental response parser: feed() accepts text as it arrives and
+    each completed file block is recorded (and reported through the
+    optional on_file callback) as soon as its closing fence is seen, so
+    file writes can start while the completion is still streaming.
+
+    Single linear scan over the lines with a small state machine instead
+    of two full regex passes. Tracking whether we are inside a fenced
+    code block also means a literal "### File:" inside code is no longer
+    mistaken for a new header.
+    """
+
+    def __init__(self, on_file=None):
+        self.modified_files = {}
+        self.files_to_delete = set()  # Use a set to avoid duplicate deletions
+        self.on_file = on_file
+        self._buffer = ""
+        self._current_file = None
+        self._code_lines = None
+        self._in_code_block = False
+
+    def feed(self, text):
+        self._buffer += text
+        lines = self._buffer.split("\n")
+        self._buffer = lines.pop()  # Keep the trailing partial line
+        for line in lines:
+            self._handle_line(line)
+
+    def close(self):
+        if self._buffer:
+            self._handle_line(self._buffer)
+            self._buffer = ""
+
+    @property
+    def incomplete(self):
+        # True when the text ended inside a fenced block, i.e. the
+        # response was cut off mid-file.
+        return self._in_code_block
+
+    def _handle_line(self, line):
+        if self._in_code_block:
+            if line.startswith("```"):
+                code = "\n".join(self._code_lines)
+                self.modified_files[self._current_file] = code
+                logging.debug("Parsed modification for file: %s", self._current_file)
+                if self.on_file is not None:
+                    self.on_file(self._current_file, code)
+                self._current_file = None
+                self._code_lines = None
+                self._in_code_block = False
+            else:
+                self._code_lines.append(line)
+        elif line.startswith("### File: "):
+            self._current_file = os.path.normpath(line[len("### File: "):].strip())
+        elif line.startswith("### DELETE: "):
+            file_path = os.path.normpath(line[len("### DELETE: "):].strip())
+            self.files_to_delete.add(file_path)
+            logging.debug("Parsed deletion instruction for file: %s", file_path)
+        elif self._current_file is not None and line.startswith("```"):
+            self._in_code_block = True
+            self._code_lines = []
+
 def parse_gpt_response(response_text):
     """
     Parse the GPT response to extract modified code for each file and files to delete.
     """
-    # Pattern to match modified files
-    file_pattern = r"### File: (?P<file>.+?)\n```(?P<language>\w+)?\n(?P<code>.*?)\n```"
-    # Updated pattern to match files to delete, anchored to the start of a line
-    delete_pattern = r"^### DELETE: (?P<file>.+)$"
+    parser = StreamingResponseParser()
+    parser.feed(response_text)
+    parser.close()
 
-    modified_files = {}
-    files_to_delete = set()  # Use a set to avoid duplicate deletions
-
-    # Parse modified files
-    for match in re.finditer(file_pattern, response_text, re.DOTALL):
-        raw_file_path = match.group("file").strip()
-        file_path = os.path.normpath(raw_file_path)
-        code = match.group("code")
-        modified_files[file_path] = code
-        logging.debug(f"Parsed modification for file: {file_path}")
-
-    # Parse files to delete
-    for match in re.finditer(delete_pattern, response_text, re.MULTILINE):
-        raw_file_path = match.group("file").strip()
-        file_path = os.path.normpath(raw_file_path)
-        files_to_delete.add(file_path)  # Add to set to ensure uniqueness
-        logging.debug(f"Parsed deletion instruction for file: {file_path}")
-
-    logging.info(f"Total modified files parsed: {len(modified_files)}")
-    logging.info(f"Total files to delete parsed: {len(files_to_delete)}")
-    return modified_files, list(files_to_delete)
+    logging.info(f"Total modified files parsed: {len(parser.modified_files)}")
+    logging.info(f"Total files to delete parsed: {len(parser.files_to_delete)}")
+    return parser.modified_files, list(parser.files_to_delete)
 
 # ==============================
 #          DELETE FILES
@@ -317,29 +929,42 @@ def parse_gpt_response(response_text):
 def delete_files(ROOT_DIRECTORY, files_to_delete):
     """
     Delete the specified files or directories from the filesystem.
+
+    Entries whose ancestor directory is also marked for deletion are
+    skipped up front: the ancestor's rmtree removes the whole subtree
+    in one call instead of one unlink per child.
     """
-    for file_path in files_to_delete:
+    targets = {os.path.normpath(p) for p in files_to_delete}
+    pruned = []
+    for file_path in sorted(targets):
+        parts = file_path.split(os.sep)
+        if any(os.sep.join(parts[:i]) in targets for i in range(1, len(parts))):
+            logging.debug("Skipping %s; an ancestor is already being deleted.", file_path)
+            continue
+        pruned.append(file_path)
+
+    for file_path in pruned:
         absolute_path = os.path.join(ROOT_DIRECTORY, file_path)
         if os.path.isfile(absolute_path):
             try:
                 os.remove(absolute_path)
-                logging.info(f"Deleted file: {file_path}")
+                logging.info("Deleted file: %s", file_path)
             except Exception as e:
-                logging.error(f"Error deleting file {file_path}: {str(e)}")
+                logging.error("Error deleting file %s: %s", file_path, e)
         elif os.path.isdir(absolute_path):
             try:
                 shutil.rmtree(absolute_path)
-                logging.info(f"Deleted directory and its contents: {file_path}")
+                logging.info("Deleted directory and its contents: %s", file_path)
             except Exception as e:
-                logging.error(f"Error deleting directory {file_path}: {str(e)}")
+                logging.error("Error deleting directory %s: %s", file_path, e)
         else:
-            logging.warning(f"File or directory to delete does not exist: {file_path}")
+            logging.warning("File or directory to delete does not exist: %s", file_path)
 
 # ==============================
 #            MAIN
 # ==============================
 
-def main():
+async def amain():
     setup_logging()
 
     logging.info("Starting the code modification script.")
@@ -349,13 +974,24 @@ def main():
         logging.warning("No files to process. Exiting.")
         return
 
+    # Validated now, saved after token counting has filled in any
+    # recomputed counts for changed files.
+    file_cache = None
+    if USE_FILE_CACHE:
+        file_cache = refresh_file_cache(load_file_cache(ROOT_DIRECTORY), ROOT_DIRECTORY, files_to_process)
+
+    # Read files concurrently; the GIL is released during the blocking reads,
+    # so a thread pool overlaps the I/O wait across files.
+    absolute_paths = [os.path.join(ROOT_DIRECTORY, f) for f in files_to_process]
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        contents = list(executor.map(read_file_content, absolute_paths))
+
     files_content = {}
-    for file_path in files_to_process:
-        absolute_path = os.path.join(ROOT_DIRECTORY, file_path)
-        content = read_file_content(absolute_path)
+    for file_path, content in zip(files_to_process, contents):
         if content is not None:
             files_content[file_path] = content
-            logging.debug(f"Read content from {file_path}")
+            logging.debug("Read content from %s", file_path)
 
     if not files_content:
         logging.error("No file contents to process. Exiting.")
@@ -366,11 +1002,44 @@ def main():
         logging.warning("No prompt provided. Exiting.")
         return
 
-    logging.info("Calling OpenAI GPT API to process code changes...")
-    gpt_response, usage = call_gpt_api(prompt, files_content)
+    write_tasks = []
+    written_files = set()
 
-    logging.info("Parsing GPT response...")
-    modified_files, files_to_delete = parse_gpt_response(gpt_response)
+    def write_streamed_file(file_path, code):
+        # Called by the streaming parser as soon as a file block closes,
+        # so writes overlap with the rest of the completion being generated.
+        if file_path in files_content:
+            written_files.add(file_path)
+            absolute_path = os.path.join(ROOT_DIRECTORY, file_path)
+            write_tasks.append(asyncio.create_task(asyncio.to_thread(write_file_content, absolute_path, code)))
+
+    token_counts = count_tokens(files_content, file_cache)
+    if file_cache is not None:
+        save_file_cache(ROOT_DIRECTORY, file_cache)
+
+    shards = shard_files(files_content, token_counts)
+    if USE_BATCH_API:
+        logging.info(f"Submitting {len(shards)} request(s) via the OpenAI Batch API...")
+        results = await call_gpt_batch_api(prompt, shards)
+    else:
+        logging.info(f"Calling OpenAI GPT API with {len(shards)} concurrent request(s)...")
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+        async def bounded_call(shard):
+            async with semaphore:
+                return await call_gpt_api(prompt, shard, on_file=write_streamed_file)
+
+        results = await asyncio.gather(*(bounded_call(shard) for shard in shards))
+
+    logging.info("Merging GPT responses...")
+    modified_files = {}
+    files_to_delete = []
+    usages = []
+    for shard_modified, shard_deleted, usage in results:
+        modified_files.update(shard_modified)
+        files_to_delete.extend(shard_deleted)
+        if usage is not None:
+            usages.append(usage)
 
     # Process file deletions
     if files_to_delete:
@@ -379,25 +1048,34 @@ def main():
     else:
         logging.info("No files to delete as per GPT instructions.")
 
-    # Update files with modified content
+    # Update files with modified content. Writes not already dispatched
+    # during streaming go out concurrently on worker threads so the
+    # kernel can flush them in parallel.
     if modified_files:
         for file_path, new_content in modified_files.items():
-            if file_path in files_content:
+            if file_path in written_files:
+                logging.info("File %s was updated while the response streamed in.", file_path)
+            elif file_path in files_content:
                 absolute_path = os.path.join(ROOT_DIRECTORY, file_path)
-                write_file_content(absolute_path, new_content)
-                logging.info(f"File {file_path} has been updated.")
-                logging.debug(f"Updated content for {file_path}:\n{new_content}")
+                write_tasks.append(asyncio.create_task(asyncio.to_thread(write_file_content, absolute_path, new_content)))
+                logging.info("File %s has been updated.", file_path)
+                if logging.getLogger().isEnabledFor(logging.DEBUG):
+                    logging.debug("Updated content for %s:\n%s", file_path, new_content)
             else:
-                logging.warning(f"Received modification for unknown file {file_path}. Skipping.")
+                logging.warning("Received modification for unknown file %s. Skipping.", file_path)
     else:
         logging.info("No file modifications received from GPT.")
 
+    # Make sure all writes have finished before reporting completion.
+    if write_tasks:
+        await asyncio.gather(*write_tasks)
+
     logging.info("All applicable files have been processed and updated.")
 
     # ----- Cost Estimation -----
-    if usage is not None:
-        prompt_tokens = getattr(usage, 'prompt_tokens', 0)
-        completion_tokens = getattr(usage, 'completion_tokens', 0)
+    if usages:
+        prompt_tokens = sum(getattr(usage, 'prompt_tokens', 0) for usage in usages)
+        completion_tokens = sum(getattr(usage, 'completion_tokens', 0) for usage in usages)
 
         cost_input = prompt_tokens * COST_PER_INPUT_TOKEN
         cost_output = completion_tokens * COST_PER_OUTPUT_TOKEN
@@ -411,5 +1089,8 @@ def main():
     else:
         logging.warning("No usage information available for cost estimation.")
 
+def main():
+    asyncio.run(amain())
+
 if __name__ == "__main__":
     main()